@@ -1,11 +1,23 @@
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, make_response
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, make_response, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 from dotenv import load_dotenv
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 import smtplib
+import click
+from concurrent.futures import ThreadPoolExecutor
 import io
+import math
+import json
+import glob
+import uuid
+import queue
+import threading
+import atexit
+import numpy as np
 from base64 import b64encode
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
@@ -15,6 +27,7 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 
 from functools import wraps
+from itertools import groupby
 
 #Cargar las variables de entorno
 
@@ -110,12 +123,20 @@ class Creditos(db.Model):
             'fecha_fin': self.fecha_fin
         }
 
+# Valores con los que se guarda el saldo de un crédito liquidado
+# (marcar_pago guarda 0, la conciliación guarda 0.0)
+TOTALES_LIQUIDADOS = ('0', '0.0', '0.00', '-0.0')
+
+# Filtros de créditos activos/liquidados para las consultas de operación
+CREDITO_ACTIVO = Creditos.total.notin_(TOTALES_LIQUIDADOS)
+CREDITO_LIQUIDADO = Creditos.total.in_(TOTALES_LIQUIDADOS)
+
 #pagos
 class Pagos(db.Model):
     __tablename__ = 'pagos'
     id_pago = db.Column(db.Integer, primary_key=True, autoincrement=True)
     id_cliente = db.Column(db.Integer, db.ForeignKey('clientes.id_cliente'), nullable=False)
-    id_credito = db.Column(db.Integer, db.ForeignKey('creditos.id_credito'), nullable=False)
+    id_credito = db.Column(db.Integer, db.ForeignKey('creditos.id_credito'), nullable=False, index=True)
     cantidad = db.Column(db.String)
     fecha = db.Column(db.String)
     status = db.Column(db.String)
@@ -136,6 +157,33 @@ class Pagos(db.Model):
             'status': self.status
         }
 
+#creditos archivados (liquidados, fuera de las tablas de operación)
+class CreditosArchivo(db.Model):
+    __tablename__ = 'creditos_archivo'
+    id_credito = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id_cliente = db.Column(db.Integer, db.ForeignKey('clientes.id_cliente'), nullable=False, index=True)
+    monto = db.Column(db.String)
+    interes = db.Column(db.String)
+    total = db.Column(db.String)
+    total_original = db.Column(db.String)
+    no_pagos = db.Column(db.String)
+    fecha_inicio = db.Column(db.String)
+    fecha_fin = db.Column(db.String)
+    fecha_archivo = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relación con Cliente
+    cliente = db.relationship('Cliente', backref=db.backref('creditos_archivo', lazy=True))
+
+#pagos archivados
+class PagosArchivo(db.Model):
+    __tablename__ = 'pagos_archivo'
+    id_pago = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id_cliente = db.Column(db.Integer, db.ForeignKey('clientes.id_cliente'), nullable=False)
+    id_credito = db.Column(db.Integer, db.ForeignKey('creditos_archivo.id_credito'), nullable=False, index=True)
+    cantidad = db.Column(db.String)
+    fecha = db.Column(db.String)
+    status = db.Column(db.String)
+
 # Modelo para la tabla financiera_datos
 class FinancieraDatos(db.Model):
     __tablename__ = 'financiera_datos'
@@ -150,11 +198,280 @@ class Usuario(db.Model):
     id_usuario = db.Column(db.Integer, primary_key=True, autoincrement=True)
     usuario = db.Column(db.String, nullable=False, unique=True)
     contrasena = db.Column(db.String, nullable=False)
+# Modelo para la tabla auditoria (solo se insertan registros, nunca se modifican)
+class Auditoria(db.Model):
+    __tablename__ = 'auditoria'
+    id_auditoria = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    fecha = db.Column(db.DateTime, nullable=False, index=True)
+    usuario = db.Column(db.String)
+    tabla = db.Column(db.String, nullable=False)
+    accion = db.Column(db.String, nullable=False)
+    id_registro = db.Column(db.String, index=True)
+    id_cliente = db.Column(db.Integer, index=True)
+    id_credito = db.Column(db.Integer, index=True)
+    antes = db.Column(db.Text)
+    despues = db.Column(db.Text)
+
+# Modelo para la tabla puntajes_clientes (puntaje de riesgo precalculado)
+class PuntajeCliente(db.Model):
+    __tablename__ = 'puntajes_clientes'
+    id_cliente = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    puntaje = db.Column(db.Float, nullable=False)
+    razon_puntual = db.Column(db.Float)
+    dias_atraso_prom = db.Column(db.Float)
+    num_creditos = db.Column(db.Integer, nullable=False, default=0)
+    num_pagos = db.Column(db.Integer, nullable=False, default=0)
+    reversiones = db.Column(db.Integer, nullable=False, default=0)
+    ultimo_id_auditoria = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), nullable=False, default=0)
+    fecha_calculo = db.Column(db.DateTime, default=datetime.utcnow)
+
 # Crear las tablas si no existen
 with app.app_context():
     db.create_all()
     db.session.commit()
 
+#Auditoría
+
+# Tablas auditadas: se registran altas, cambios y bajas hechas a través del ORM
+MODELOS_AUDITADOS = (Cliente, Creditos, Pagos, FinancieraDatos)
+
+AUDITORIA_COLA_MAX = int(os.getenv('AUDITORIA_COLA_MAX', '10000'))
+AUDITORIA_LOTE = int(os.getenv('AUDITORIA_LOTE', '200'))
+AUDITORIA_ARCHIVO = os.getenv('AUDITORIA_ARCHIVO', os.path.join(app.root_path, 'auditoria_pendiente.jsonl'))
+
+_auditoria = {'cola': queue.Queue(maxsize=AUDITORIA_COLA_MAX), 'hilo': None, 'pid': None}
+_auditoria_lock = threading.Lock()
+
+def _guardar_en_archivo(registros):
+    # Respaldo durable cuando la cola está llena o la base de datos no responde.
+    # Un solo write() sobre un descriptor O_APPEND para que los lotes de varios
+    # workers de gunicorn no se intercalen
+    contenido = ''.join(json.dumps(registro, default=str) + '\n' for registro in registros).encode('utf-8')
+    descriptor = os.open(AUDITORIA_ARCHIVO, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(descriptor, contenido)
+    finally:
+        os.close(descriptor)
+
+_reintento_lock = threading.Lock()
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _reclamar_archivo(origen):
+    # Renombrar es atómico: si otro proceso lo reclamó primero, falla.
+    # El nombre lleva el pid para saber después si su dueño sigue vivo
+    destino = f"{AUDITORIA_ARCHIVO}.{os.getpid()}.{uuid.uuid4().hex}.reintento"
+    try:
+        os.rename(origen, destino)
+    except FileNotFoundError:
+        return None
+    return destino
+
+def _reclamados_abandonados():
+    # Archivos reclamados por un proceso que murió antes de terminar, o por
+    # un intento fallido de este mismo proceso
+    abandonados = []
+    for pendiente in glob.glob(f"{glob.escape(AUDITORIA_ARCHIVO)}.*.reintento"):
+        try:
+            pid = int(pendiente[len(AUDITORIA_ARCHIVO) + 1:].split('.', 1)[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or not _proceso_vivo(pid):
+            abandonados.append(pendiente)
+    return abandonados
+
+def reintentar_auditoria_pendiente(engine):
+    # Cargar en la tabla auditoria los registros del archivo de respaldo.
+    # El archivo se renombra primero (operación atómica) para que solo un
+    # proceso lo procese y los nuevos respaldos vayan a un archivo nuevo.
+    # Si el proceso falla a medias, el archivo reclamado queda en disco y la
+    # siguiente ejecución lo retoma
+    if not _reintento_lock.acquire(blocking=False):
+        return 0
+    try:
+        reclamados = [_reclamar_archivo(pendiente)
+                      for pendiente in [AUDITORIA_ARCHIVO] + _reclamados_abandonados()]
+
+        total = 0
+        for en_proceso in filter(None, reclamados):
+            registros = []
+            with open(en_proceso, encoding='utf-8') as archivo:
+                for linea in archivo:
+                    try:
+                        registros.append(json.loads(linea))
+                    except ValueError:
+                        print(f"Línea de auditoría inválida descartada: {linea[:200]!r}")
+
+            # Lo que no se pueda escribir vuelve al archivo de respaldo
+            for i in range(0, len(registros), AUDITORIA_LOTE):
+                _escribir_lote(engine, registros[i:i + AUDITORIA_LOTE])
+            os.remove(en_proceso)
+            total += len(registros)
+        return total
+    finally:
+        _reintento_lock.release()
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+def registro_auditoria(tabla, accion, id_registro, antes, despues, usuario=None, fecha=None,
+                       id_cliente=None, id_credito=None):
+    # id_cliente e id_credito se guardan como columnas para consultarlos con SQL
+    valores = {**(antes or {}), **(despues or {})}
+    if id_cliente is None:
+        id_cliente = valores.get('id_cliente')
+    if id_credito is None:
+        id_credito = valores.get('id_credito')
+    return {
+        'fecha': fecha or datetime.utcnow().isoformat(),
+        'usuario': usuario,
+        'tabla': tabla,
+        'accion': accion,
+        'id_registro': str(id_registro),
+        'id_cliente': _entero(id_cliente),
+        'id_credito': _entero(id_credito),
+        'antes': json.dumps(antes, default=str) if antes is not None else None,
+        'despues': json.dumps(despues, default=str) if despues is not None else None
+    }
+
+def insertar_auditoria(conexion, registros):
+    # Inserción directa, para procesos por lotes que escriben la auditoría
+    # en la misma transacción que sus cambios
+    if registros:
+        # Los registros del archivo de respaldo anteriores a estas columnas no las traen
+        filas = [{'id_cliente': None, 'id_credito': None, **registro, 'fecha': datetime.fromisoformat(registro['fecha'])}
+                 for registro in registros]
+        conexion.execute(Auditoria.__table__.insert(), filas)
+
+def _escribir_lote(engine, registros):
+    try:
+        with engine.begin() as conexion:
+            insertar_auditoria(conexion, registros)
+    except Exception as e:
+        print(f"Error al escribir auditoría: {e}")
+        _guardar_en_archivo(registros)
+
+def _escritor_auditoria(cola):
+    with app.app_context():
+        engine = db.engine
+    try:
+        reintentar_auditoria_pendiente(engine)
+    except Exception as e:
+        print(f"Error al reintentar auditoría pendiente: {e}")
+    while True:
+        registro = cola.get()
+        if registro is None:
+            break
+        lote = [registro]
+        # Vaciar lo que ya esté en la cola hasta completar el lote
+        while len(lote) < AUDITORIA_LOTE:
+            try:
+                registro = cola.get_nowait()
+            except queue.Empty:
+                break
+            if registro is None:
+                _escribir_lote(engine, lote)
+                return
+            lote.append(registro)
+        _escribir_lote(engine, lote)
+
+def _iniciar_escritor():
+    # Los hilos no sobreviven al fork de gunicorn: iniciar uno por proceso
+    if _auditoria['pid'] == os.getpid() and _auditoria['hilo'].is_alive():
+        return
+    with _auditoria_lock:
+        if _auditoria['pid'] == os.getpid() and _auditoria['hilo'].is_alive():
+            return
+        _auditoria['cola'] = queue.Queue(maxsize=AUDITORIA_COLA_MAX)
+        _auditoria['hilo'] = threading.Thread(target=_escritor_auditoria, args=(_auditoria['cola'],), daemon=True)
+        _auditoria['pid'] = os.getpid()
+        _auditoria['hilo'].start()
+
+def encolar_auditoria(registros):
+    _iniciar_escritor()
+    for i, registro in enumerate(registros):
+        try:
+            _auditoria['cola'].put_nowait(registro)
+        except queue.Full:
+            _guardar_en_archivo(registros[i:])
+            break
+
+def detener_auditoria(espera=10):
+    # Vaciar la cola antes de terminar el proceso
+    if _auditoria['pid'] != os.getpid() or not _auditoria['hilo'].is_alive():
+        return
+    try:
+        _auditoria['cola'].put(None, timeout=espera)
+    except queue.Full:
+        pass
+    _auditoria['hilo'].join(espera)
+
+atexit.register(detener_auditoria)
+
+def _valores(objeto, atributo='committed'):
+    estado = inspect(objeto)
+    valores = {}
+    for columna in estado.mapper.column_attrs:
+        historial = estado.attrs[columna.key].history
+        if atributo == 'committed':
+            valor = (historial.unchanged or historial.deleted or [None])[0]
+        else:
+            valor = getattr(objeto, columna.key)
+        valores[columna.key] = valor
+    return valores
+
+@event.listens_for(Session, 'after_flush')
+def capturar_auditoria(sesion, contexto):
+    usuario = session.get('usuario') if has_request_context() else None
+    ahora = datetime.utcnow().isoformat()
+    pendientes = sesion.info.setdefault('auditoria', [])
+
+    def agregar(objeto, accion, antes, despues):
+        identidad = inspect(objeto).mapper.primary_key_from_instance(objeto)
+        pendientes.append(registro_auditoria(
+            objeto.__tablename__, accion, ','.join(str(v) for v in identidad), antes, despues, usuario, ahora,
+            getattr(objeto, 'id_cliente', None), getattr(objeto, 'id_credito', None)
+        ))
+
+    for objeto in sesion.new:
+        if isinstance(objeto, MODELOS_AUDITADOS):
+            agregar(objeto, 'alta', None, _valores(objeto, 'actual'))
+    for objeto in sesion.dirty:
+        if isinstance(objeto, MODELOS_AUDITADOS) and sesion.is_modified(objeto, include_collections=False):
+            estado = inspect(objeto)
+            antes, despues = {}, {}
+            for columna in estado.mapper.column_attrs:
+                historial = estado.attrs[columna.key].history
+                if historial.has_changes():
+                    antes[columna.key] = (historial.deleted or [None])[0]
+                    despues[columna.key] = (historial.added or [None])[0]
+            if despues:
+                agregar(objeto, 'cambio', antes, despues)
+    for objeto in sesion.deleted:
+        if isinstance(objeto, MODELOS_AUDITADOS):
+            agregar(objeto, 'baja', _valores(objeto), None)
+
+@event.listens_for(Session, 'after_commit')
+def enviar_auditoria(sesion):
+    pendientes = sesion.info.pop('auditoria', None)
+    if pendientes:
+        encolar_auditoria(pendientes)
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_auditoria(sesion):
+    sesion.info.pop('auditoria', None)
+
 # Ruta raiz
 @app.route('/')
 def root():
@@ -172,8 +489,9 @@ def index():
     #Realiza una consulta de todos los alumnos
     clientes = Cliente.query.all()
     total_clientes = Cliente.query.count()
+    puntajes = obtener_puntajes()
 
-    return render_template('index.html', clientes=clientes, total_clientes=total_clientes)
+    return render_template('index.html', clientes=clientes, total_clientes=total_clientes, puntajes=puntajes)
 
 
 
@@ -234,11 +552,15 @@ def update_cliente(id_cliente):
 @app.route('/creditos')
 @login_required
 def creditos():
-    #Realiza una consulta de todos los creditos
-    creditos = Creditos.query.all()
+    #Realiza una consulta de los creditos activos (los liquidados se ven en el historial)
+    creditos = Creditos.query.filter(CREDITO_ACTIVO).all()
     clientes = Cliente.query.all()
     current_date = datetime.now().date()
 
+    # Total registrado (incluye liquidados y archivados). Se consulta antes de
+    # convertir los campos de los objetos para que no se haga autoflush
+    total_creditos = Creditos.query.count() + CreditosArchivo.query.count()
+
     # Convertir fecha_fin y fecha_inicio a objetos datetime.date si son string
     for credito in creditos:
         if isinstance(credito.fecha_fin, str):
@@ -270,7 +592,6 @@ def creditos():
                 credito.total_original = 0.0
 
     # Calcular estadísticas
-    total_creditos = len(creditos)
     creditos_vigentes = 0
     creditos_vencidos = 0
     
@@ -298,8 +619,10 @@ def creditos():
 @login_required
 def creditos_pdf():
     try:
-        # Realiza una consulta de todos los creditos (misma lógica que creditos())
-        creditos = Creditos.query.all()
+        # Realiza una consulta de los creditos activos (misma lógica que creditos()).
+        # El cliente se carga junto con el crédito para que la carga diferida no
+        # haga autoflush de los campos convertidos más abajo
+        creditos = Creditos.query.options(db.joinedload(Creditos.cliente)).filter(CREDITO_ACTIVO).all()
         current_date = datetime.now().date()
 
         # Convertir fecha_fin y fecha_inicio a objetos datetime.date si son string (misma lógica)
@@ -478,7 +801,7 @@ def create_creditos():
             return redirect(url_for('creditos'))
 
         # Renderizar el formulario si el método es GET
-        return render_template('create_credito.html', clientes=clientes)
+        return render_template('create_credito.html', clientes=clientes, puntajes=obtener_puntajes())
 
     except Exception as e:
         # En caso de error, imprimir el error y redirigir al menú
@@ -486,6 +809,79 @@ def create_creditos():
         return redirect(url_for('menu'))
     
 
+# Calcular cotizaciones de varios escenarios de crédito a la vez (sin guardar nada)
+def calcular_cotizaciones(montos, intereses, no_pagos, fechas_inicio):
+    montos = np.asarray(montos, dtype=float)
+    intereses = np.asarray(intereses, dtype=float)
+    no_pagos = np.asarray(no_pagos, dtype=np.int64)
+    inicios = np.asarray(fechas_inicio, dtype='datetime64[D]')
+
+    # Interés plano, igual que en create_creditos()
+    totales = montos + montos * (intereses / 100)
+    pagos_semanales = totales / no_pagos
+    fechas_fin = inicios + no_pagos * 7
+
+    # Matriz de fechas de pago: una fila por escenario, un pago cada 7 días
+    semanas = np.arange(1, int(no_pagos.max()) + 1)
+    fechas = inicios[:, None] + semanas[None, :] * 7
+    validas = semanas[None, :] <= no_pagos[:, None]
+
+    return totales, pagos_semanales, fechas_fin, fechas, validas
+
+# Límites de la cotización para acotar el tamaño de la matriz de fechas
+COTIZACION_MAX_ESCENARIOS = 1000
+COTIZACION_MAX_PAGOS = 520  # 10 años de pagos semanales
+
+@app.route('/creditos/cotizar', methods=['POST'])
+@login_required
+def cotizar_creditos():
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict):
+        return jsonify({'error': 'El cuerpo debe ser un objeto JSON con la lista de escenarios'}), 400
+    escenarios = datos.get('escenarios', [])
+    if not isinstance(escenarios, list) or not escenarios:
+        return jsonify({'error': 'Se requiere una lista de escenarios'}), 400
+    if len(escenarios) > COTIZACION_MAX_ESCENARIOS:
+        return jsonify({'error': f'Máximo {COTIZACION_MAX_ESCENARIOS} escenarios por cotización'}), 400
+
+    try:
+        montos = [float(e['monto']) for e in escenarios]
+        intereses = [float(e['interes']) for e in escenarios]
+        no_pagos = [float(e['no_pagos']) for e in escenarios]
+        fechas_inicio = [datetime.strptime(e['fecha_inicio'], '%Y-%m-%d').date() for e in escenarios]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Cada escenario requiere monto, interes, no_pagos y fecha_inicio (AAAA-MM-DD)'}), 400
+
+    if not all(math.isfinite(v) for v in montos + intereses):
+        return jsonify({'error': 'monto e interes deben ser números finitos'}), 400
+    if min(intereses) < 0:
+        return jsonify({'error': 'El interés no puede ser negativo'}), 400
+    if not all(math.isfinite(n) and n.is_integer() for n in no_pagos):
+        return jsonify({'error': 'no_pagos debe ser un número entero'}), 400
+    no_pagos = [int(n) for n in no_pagos]
+    if min(no_pagos) <= 0 or max(no_pagos) > COTIZACION_MAX_PAGOS or min(montos) < 0:
+        return jsonify({'error': f'El monto no puede ser negativo y no_pagos debe estar entre 1 y {COTIZACION_MAX_PAGOS}'}), 400
+
+    totales, pagos_semanales, fechas_fin, fechas, validas = calcular_cotizaciones(
+        montos, intereses, no_pagos, fechas_inicio
+    )
+    fechas_str = np.datetime_as_string(fechas, unit='D')
+
+    resultados = []
+    for i in range(len(escenarios)):
+        resultados.append({
+            'monto': montos[i],
+            'interes': intereses[i],
+            'no_pagos': no_pagos[i],
+            'fecha_inicio': fechas_inicio[i].strftime('%Y-%m-%d'),
+            'fecha_fin': str(fechas_fin[i]),
+            'total': round(float(totales[i]), 2),
+            'pago_semanal': round(float(pagos_semanales[i]), 2),
+            'fechas_pagos': fechas_str[i][validas[i]].tolist()
+        })
+
+    return jsonify({'cotizaciones': resultados})
+
 @app.route('/detalle_credito/<int:id_cliente>/<int:id_credito>')
 @login_required
 def detalle_credito(id_cliente, id_credito):
@@ -499,7 +895,8 @@ def detalle_credito(id_cliente, id_credito):
         fecha_pagos = []
         # Verificar si fecha_inicio es un string o un objeto datetime.date
         if isinstance(credito.fecha_inicio, str):
-            fecha_actual = datetime.strptime(credito.fecha_inicio, '%Y-%m-%d').date() + timedelta(days=7)
+            # Acepta AAAA-MM-DD y DD/MM/AAAA (créditos antiguos)
+            fecha_actual = parsear_fecha(credito.fecha_inicio) + timedelta(days=7)
         else:
             fecha_actual = credito.fecha_inicio + timedelta(days=7)  # Si ya es un objeto datetime.date
 
@@ -525,13 +922,14 @@ def delete_credito(id_credito):
         # Obtener el crédito
         credito = Creditos.query.get(id_credito)
         if credito:
-            # Eliminar los pagos asociados
-            Pagos.query.filter_by(id_credito=id_credito).delete()
+            # Eliminar los pagos asociados (uno por uno para que queden en la auditoría)
+            for pago in Pagos.query.filter_by(id_credito=id_credito).all():
+                db.session.delete(pago)
 
             # Eliminar el crédito
             db.session.delete(credito)
             db.session.commit()
-        return redirect(url_for('creditos'))
+        return redirect(url_for('historial_creditos'))
     except Exception as e:
         print(f"Error: {e}")
         return redirect(url_for('creditos'))
@@ -597,12 +995,118 @@ def cancelar_pago(id_credito, fecha):
         flash("Error al cancelar el pago", "danger")
         return redirect(url_for('menu'))
 
+# Convertir fecha_inicio almacenada como texto a objeto date
+def parsear_fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(str(valor).strip(), formato).date()
+        except (ValueError, TypeError):
+            continue
+    return None
+
+# Caché del pronóstico de cobranza, se invalida cuando cambian pagos o créditos
+_cache_pronostico = {'clave': None, 'datos': None}
+
+def huella_cartera():
+    # Consulta ligera que cambia con cada alta, baja o cambio de saldo en pagos
+    # o créditos (incluye las reparaciones de conciliar-saldos), válida entre
+    # varios workers de gunicorn
+    pagos = db.session.query(
+        db.func.count(Pagos.id_pago), db.func.max(Pagos.id_pago),
+        db.func.sum(db.cast(Pagos.cantidad, db.Float))
+    ).one()
+    creditos = db.session.query(
+        db.func.count(Creditos.id_credito), db.func.max(Creditos.id_credito),
+        db.func.sum(db.cast(Creditos.total, db.Float)), db.func.sum(db.cast(Creditos.total_original, db.Float))
+    ).one()
+    return (tuple(pagos), tuple(creditos))
+
+def pronostico_cobranza(semanas=12):
+    hoy = date.today()
+    clave = (huella_cartera(), hoy, semanas)
+    if _cache_pronostico['clave'] == clave:
+        return _cache_pronostico['datos']
+
+    filas = db.session.query(
+        Creditos.id_credito, Creditos.total, Creditos.total_original,
+        Creditos.no_pagos, Creditos.fecha_inicio
+    ).all()
+    pagado_por_credito = dict(
+        db.session.query(Pagos.id_credito, db.func.sum(db.cast(Pagos.cantidad, db.Float)))
+        .group_by(Pagos.id_credito).all()
+    )
+
+    ids, originales, num_pagos, inicios, pagados = [], [], [], [], []
+    for id_credito, total, total_original, no_pagos, fecha_inicio in filas:
+        try:
+            restante = float(total)
+            original = float(total_original)
+            n = int(float(no_pagos))
+        except (ValueError, TypeError):
+            continue
+        inicio = parsear_fecha(fecha_inicio)
+        if restante <= 0 or n <= 0 or inicio is None:
+            continue
+        ids.append(id_credito)
+        originales.append(original)
+        num_pagos.append(n)
+        inicios.append(inicio)
+        pagados.append(float(pagado_por_credito.get(id_credito) or 0.0))
+
+    etiquetas = [(hoy + timedelta(days=7 * w)).strftime('%d/%m') for w in range(semanas)]
+    if not ids:
+        datos = {'etiquetas': etiquetas, 'esperados': [0.0] * semanas, 'vencido': 0.0, 'tasa_morosidad': 0.0}
+        _cache_pronostico.update(clave=clave, datos=datos)
+        return datos
+
+    originales = np.array(originales)
+    num_pagos = np.array(num_pagos, dtype=np.int64)
+    inicios = np.array(inicios, dtype='datetime64[D]')
+    pagados = np.array(pagados)
+    cuotas = originales / num_pagos
+
+    # Días transcurridos desde el inicio; la cuota k vence el día 7·k
+    transcurridos = (np.datetime64(hoy, 'D') - inicios).astype(np.int64)
+
+    # Cuotas ya exigibles (vencidas antes de hoy), en forma cerrada por crédito.
+    # Lo pagado cubre primero las cuotas más antiguas
+    k_vencidas = np.clip((transcurridos - 1) // 7, 0, num_pagos)
+    total_exigible = float((k_vencidas * cuotas).sum())
+    vencido = float(np.maximum(k_vencidas * cuotas - pagados, 0).sum())
+    tasa_morosidad = vencido / total_exigible if total_exigible > 0 else 0.0
+
+    # Solo se expanden las cuotas que caen en el horizonte: a lo sumo una por
+    # semana, así la matriz es de créditos × semanas sin importar no_pagos
+    k = k_vencidas[:, None] + np.arange(1, semanas + 1)[None, :]
+    validas = k <= num_pagos[:, None]
+    pendiente = np.clip(cuotas[:, None] * k - pagados[:, None], 0, cuotas[:, None]) * validas
+
+    # Agrupar las cuotas futuras por semana del horizonte
+    dias = k * 7 - transcurridos[:, None]
+    semana = dias // 7
+    en_horizonte = (semana < semanas) & validas
+    esperados = np.bincount(semana[en_horizonte], weights=pendiente[en_horizonte], minlength=semanas)
+    esperados = esperados * (1 - tasa_morosidad)
+
+    datos = {
+        'etiquetas': etiquetas,
+        'esperados': [round(float(v), 2) for v in esperados],
+        'vencido': round(vencido, 2),
+        'tasa_morosidad': round(tasa_morosidad, 4)
+    }
+    _cache_pronostico.update(clave=clave, datos=datos)
+    return datos
+
 @app.route('/total', methods=['GET', 'POST'])
 @login_required
 def total():
     try:
-        # Obtener todos los créditos y sumar sus totales
-        creditos = Creditos.query.all()
+        # Obtener los créditos activos y sumar sus totales
+        creditos = Creditos.query.filter(CREDITO_ACTIVO).all()
         monto_total = 0.0
         
         for credito in creditos:
@@ -735,21 +1239,29 @@ def total():
     creditos_por_año_mes = {}
     años_disponibles = set()
     
-    for credito in creditos:
+    # Incluir las fechas de inicio de los créditos liquidados y archivados en el historial
+    try:
+        fechas_inicio = [credito.fecha_inicio for credito in creditos]
+        fechas_inicio += [fila[0] for fila in db.session.query(Creditos.fecha_inicio).filter(CREDITO_LIQUIDADO)]
+        fechas_inicio += [fila[0] for fila in db.session.query(CreditosArchivo.fecha_inicio)]
+    except Exception:
+        fechas_inicio = []
+
+    for fecha_inicio in fechas_inicio:
         try:
             # Verificar si fecha_inicio es una cadena o ya es un objeto date/datetime
-            if isinstance(credito.fecha_inicio, (date, datetime)):
-                fecha_obj = credito.fecha_inicio
+            if isinstance(fecha_inicio, (date, datetime)):
+                fecha_obj = fecha_inicio
                 if isinstance(fecha_obj, date) and not isinstance(fecha_obj, datetime):
                     # Si es un objeto date, crear un datetime para mantener consistencia
                     fecha_obj = datetime.combine(fecha_obj, datetime.min.time())
-            elif isinstance(credito.fecha_inicio, str):
+            elif isinstance(fecha_inicio, str):
                 # Intentar parsear la fecha en formato Y-m-d
-                if '-' in credito.fecha_inicio:
-                    fecha_obj = datetime.strptime(credito.fecha_inicio, '%Y-%m-%d')
+                if '-' in fecha_inicio:
+                    fecha_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d')
                 else:
                     # Intentar formato d/m/Y
-                    fecha_obj = datetime.strptime(credito.fecha_inicio, '%d/%m/%Y')
+                    fecha_obj = datetime.strptime(fecha_inicio, '%d/%m/%Y')
             else:
                 # Si no es ni string ni date, continuar con el siguiente crédito
                 continue
@@ -794,8 +1306,21 @@ def total():
                 meses_del_año.append(mes_nombre)
                 cantidades_del_año.append(0)
 
+    # Pronóstico de cobranza semanal
+    try:
+        semanas_pronostico = max(1, min(int(request.args.get('semanas', 12)), 104))
+    except ValueError:
+        semanas_pronostico = 12
+    try:
+        pronostico = pronostico_cobranza(semanas_pronostico)
+    except Exception as e:
+        print(f"Error al calcular pronóstico: {e}")
+        pronostico = {'etiquetas': [], 'esperados': [], 'vencido': 0.0, 'tasa_morosidad': 0.0}
+
     return render_template(
         'total.html',
+        pronostico=pronostico,
+        semanas_pronostico=semanas_pronostico,
         monto_total=monto_total,
         monto_caja=monto_caja,
         monto_socios=monto_socios,
@@ -807,6 +1332,516 @@ def total():
         creditos_por_año_mes=creditos_por_año_mes
     )
 
+# Archivar créditos liquidados (total == 0) cuya fecha de fin tenga más de `dias` días
+def archivar_creditos(dias=None, lote=500):
+    if dias is None:
+        dias = int(os.getenv('ARCHIVO_DIAS', '180'))
+    limite = date.today() - timedelta(days=dias)
+
+    # Solo columnas, sin cargar objetos del ORM
+    candidatos = []
+    for id_credito, fecha_fin in db.session.query(Creditos.id_credito, Creditos.fecha_fin).filter(CREDITO_LIQUIDADO):
+        fecha = parsear_fecha(fecha_fin)
+        if fecha is not None and fecha < limite:
+            candidatos.append(id_credito)
+
+    columnas_credito = ['id_credito', 'id_cliente', 'monto', 'interes', 'total', 'total_original',
+                        'no_pagos', 'fecha_inicio', 'fecha_fin']
+    columnas_pago = ['id_pago', 'id_cliente', 'id_credito', 'cantidad', 'fecha', 'status']
+
+    archivados = 0
+    for i in range(0, len(candidatos), lote):
+        try:
+            # Bloquear el lote y volver a comprobar que siga liquidado: un
+            # cancelar_pago entre la selección y la copia lo reactiva
+            ids = db.session.execute(
+                db.select(Creditos.id_credito)
+                .where(Creditos.id_credito.in_(candidatos[i:i + lote]), CREDITO_LIQUIDADO)
+                .with_for_update()
+            ).scalars().all()
+            if not ids:
+                db.session.commit()
+                continue
+            lote_liquidado = db.and_(Creditos.id_credito.in_(ids), CREDITO_LIQUIDADO)
+            pagos_del_lote = Pagos.id_credito.in_(db.select(Creditos.id_credito).where(lote_liquidado))
+
+            # Dejar constancia en la auditoría de cada crédito y pago que sale de las tablas de operación
+            ahora = datetime.utcnow().isoformat()
+            registros = []
+            for modelo, columnas, filtro, llave in ((Creditos, columnas_credito, lote_liquidado, 'id_credito'),
+                                                    (Pagos, columnas_pago, pagos_del_lote, 'id_pago')):
+                for fila in db.session.execute(db.select(*[getattr(modelo, c) for c in columnas]).where(filtro)):
+                    valores = dict(fila._mapping)
+                    registros.append(registro_auditoria(
+                        modelo.__tablename__, 'archivo', valores[llave], valores, None, 'sistema', ahora
+                    ))
+            insertar_auditoria(db.session, registros)
+
+            # Copiar con INSERT ... SELECT y borrar de las tablas de operación en la misma transacción
+            db.session.execute(db.insert(CreditosArchivo).from_select(
+                columnas_credito,
+                db.select(*[getattr(Creditos, c) for c in columnas_credito]).where(lote_liquidado)
+            ))
+            db.session.execute(db.insert(PagosArchivo).from_select(
+                columnas_pago,
+                db.select(*[getattr(Pagos, c) for c in columnas_pago]).where(pagos_del_lote)
+            ))
+            db.session.execute(db.delete(Pagos).where(pagos_del_lote))
+            db.session.execute(db.delete(Creditos).where(lote_liquidado))
+            db.session.commit()
+            archivados += len(ids)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    return archivados
+
+@app.cli.command('archivar-creditos')
+@click.option('--dias', type=int, default=None, help='Antigüedad mínima (días desde fecha_fin). Por defecto ARCHIVO_DIAS o 180.')
+def archivar_creditos_command(dias):
+    """Mueve los créditos liquidados y sus pagos a las tablas de archivo."""
+    archivados = archivar_creditos(dias)
+    click.echo(f"Créditos archivados: {archivados}")
+
+# Conciliación de saldos: total esperado = max(total_original - SUM(pagos), 0)
+def _conciliar_rango(engine, desde, hasta, tolerancia):
+    pagado = db.func.coalesce(db.func.sum(db.cast(Pagos.cantidad, db.Float)), 0.0)
+    esperado = db.case((db.cast(Creditos.total_original, db.Float) - pagado > 0,
+                        db.cast(Creditos.total_original, db.Float) - pagado), else_=0.0)
+    actual = db.cast(Creditos.total, db.Float)
+
+    consulta = (
+        db.select(Creditos.id_credito, actual.label('actual'), esperado.label('esperado'), Creditos.total)
+        .select_from(Creditos)
+        .outerjoin(Pagos, Pagos.id_credito == Creditos.id_credito)
+        .where(Creditos.id_credito.between(desde, hasta))
+        .group_by(Creditos.id_credito, Creditos.total, Creditos.total_original)
+        .having(db.func.abs(actual - esperado) > tolerancia)
+    )
+    with engine.connect() as conexion:
+        return [(fila.id_credito, fila.actual, fila.esperado, fila.total) for fila in conexion.execute(consulta)]
+
+def _reparar_saldos(engine, diferencias, lote):
+    # Solo se actualiza si el saldo sigue siendo el leído en la revisión; si un
+    # marcar_pago/cancelar_pago lo cambió mientras tanto, el crédito se omite
+    tabla = Creditos.__table__
+    actualizar = (
+        db.update(tabla)
+        .where(tabla.c.id_credito == db.bindparam('b_id'), tabla.c.total == db.bindparam('b_actual'))
+        .values(total=db.bindparam('b_total'))
+    )
+    reparados, omitidos = [], []
+    for i in range(0, len(diferencias), lote):
+        parametros = {id_credito: {'b_id': id_credito, 'b_actual': texto, 'b_total': str(round(esperado, 2))}
+                      for id_credito, _, esperado, texto in diferencias[i:i + lote]}
+        with engine.begin() as conexion:
+            conexion.execute(actualizar, list(parametros.values()))
+            # Comprobar qué filas quedaron con el saldo esperado
+            reparados_lote = []
+            for id_credito, total in conexion.execute(
+                db.select(tabla.c.id_credito, tabla.c.total).where(tabla.c.id_credito.in_(list(parametros)))
+            ):
+                if total == parametros[id_credito]['b_total']:
+                    reparados_lote.append(id_credito)
+                else:
+                    omitidos.append(id_credito)
+
+            ahora = datetime.utcnow().isoformat()
+            insertar_auditoria(conexion, [
+                registro_auditoria('creditos', 'conciliacion', id_credito,
+                                   {'total': parametros[id_credito]['b_actual']},
+                                   {'total': parametros[id_credito]['b_total']}, 'sistema', ahora,
+                                   id_credito=id_credito)
+                for id_credito in reparados_lote
+            ])
+            reparados.extend(reparados_lote)
+    return reparados, omitidos
+
+def conciliar_saldos(tam_rango=10000, hilos=4, tolerancia=0.01, reparar=False, lote_reparacion=1000):
+    engine = db.engine
+    minimo, maximo = db.session.query(db.func.min(Creditos.id_credito), db.func.max(Creditos.id_credito)).one()
+    if minimo is None:
+        return [], [], []
+
+    rangos = [(desde, min(desde + tam_rango - 1, maximo)) for desde in range(minimo, maximo + 1, tam_rango)]
+    diferencias = []
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        for resultado in ejecutor.map(lambda r: _conciliar_rango(engine, r[0], r[1], tolerancia), rangos):
+            diferencias.extend(resultado)
+
+    reparados, omitidos = [], []
+    if reparar and diferencias:
+        reparados, omitidos = _reparar_saldos(engine, diferencias, lote_reparacion)
+    return diferencias, reparados, omitidos
+
+@app.cli.command('conciliar-saldos')
+@click.option('--rango', type=int, default=10000, help='Créditos por rango de id.')
+@click.option('--hilos', type=int, default=4, help='Rangos procesados en paralelo.')
+@click.option('--tolerancia', type=float, default=0.01, help='Diferencia mínima a reportar.')
+@click.option('--reparar', is_flag=True, help='Actualizar creditos.total con el saldo esperado.')
+@click.option('--limite', type=int, default=50, help='Diferencias a mostrar en detalle.')
+def conciliar_saldos_command(rango, hilos, tolerancia, reparar, limite):
+    """Compara creditos.total contra total_original menos la suma de pagos."""
+    diferencias, reparados, omitidos = conciliar_saldos(rango, hilos, tolerancia, reparar)
+    diferencias.sort(key=lambda d: abs(d[1] - d[2]), reverse=True)
+
+    for id_credito, actual, esperado, _ in diferencias[:limite]:
+        click.echo(f"Crédito {id_credito}: registrado {actual:,.2f}, esperado {esperado:,.2f}, diferencia {actual - esperado:+,.2f}")
+
+    suma = sum(abs(actual - esperado) for _, actual, esperado, _ in diferencias)
+    click.echo(f"Créditos con diferencia: {len(diferencias)} (suma absoluta {suma:,.2f})")
+    if reparar and diferencias:
+        click.echo(f"Saldos reparados: {len(reparados)}")
+        if omitidos:
+            # Cambiaron durante la revisión; volver a ejecutar para conciliarlos
+            click.echo(f"Omitidos por cambios concurrentes: {', '.join(str(i) for i in sorted(omitidos))}")
+
+@app.cli.command('auditoria-reintentar')
+def auditoria_reintentar_command():
+    """Carga en la tabla auditoria los registros del archivo de respaldo."""
+    cargados = reintentar_auditoria_pendiente(db.engine)
+    click.echo(f"Registros de auditoría procesados: {cargados}")
+
+# Historial de créditos archivados
+@app.route('/creditos/historial')
+@login_required
+def historial_creditos():
+    pagina = request.args.get('pagina', 1, type=int)
+    busqueda = request.args.get('q', '').strip()
+
+    consulta = CreditosArchivo.query.join(Cliente)
+    if busqueda:
+        patron = f"%{busqueda}%"
+        consulta = consulta.filter(db.or_(
+            Cliente.nombre.ilike(patron), Cliente.ap_paterno.ilike(patron), Cliente.ap_materno.ilike(patron)
+        ))
+    paginacion = consulta.order_by(CreditosArchivo.id_credito.desc()).paginate(page=pagina, per_page=50, error_out=False)
+
+    # Créditos liquidados que aún no se archivan (solo en la primera página)
+    liquidados = []
+    if pagina == 1:
+        consulta_liquidados = Creditos.query.join(Cliente).filter(CREDITO_LIQUIDADO)
+        if busqueda:
+            consulta_liquidados = consulta_liquidados.filter(db.or_(
+                Cliente.nombre.ilike(patron), Cliente.ap_paterno.ilike(patron), Cliente.ap_materno.ilike(patron)
+            ))
+        liquidados = consulta_liquidados.order_by(Creditos.id_credito.desc()).all()
+
+    # Resumen de pagos por crédito de la página actual
+    ids = [credito.id_credito for credito in paginacion.items]
+    resumen_pagos = {}
+    if ids:
+        for id_credito, num_pagos, ultimo_pago in db.session.query(
+            PagosArchivo.id_credito, db.func.count(PagosArchivo.id_pago), db.func.max(PagosArchivo.fecha)
+        ).filter(PagosArchivo.id_credito.in_(ids)).group_by(PagosArchivo.id_credito):
+            resumen_pagos[id_credito] = {'num_pagos': num_pagos, 'ultimo_pago': ultimo_pago}
+
+    return render_template('historial.html', paginacion=paginacion, resumen_pagos=resumen_pagos,
+                           liquidados=liquidados, busqueda=busqueda)
+
+# Lista de cobranza: créditos activos con alguna cuota sin pagar a más tardar en `hasta`
+def _dias_hasta(columna_fecha, fecha):
+    # Días entre fecha_inicio (texto AAAA-MM-DD) y `fecha`, calculados en la base de datos
+    if db.engine.dialect.name == 'postgresql':
+        dias = db.literal(fecha, db.Date) - db.cast(columna_fecha, db.Date)
+    else:
+        dias = db.cast(db.func.julianday(fecha.isoformat()) - db.func.julianday(columna_fecha), db.Integer)
+    return db.case((columna_fecha.like('____-__-__'), dias), else_=None)
+
+def _menor(a, b):
+    return db.case((a < b, a), else_=b)
+
+def _mayor(a, b):
+    return db.case((a > b, a), else_=b)
+
+def lista_cobranza(desde, hasta, hoy=None):
+    hoy = hoy or date.today()
+
+    pagado = (
+        db.select(Pagos.id_credito, db.func.sum(db.cast(Pagos.cantidad, db.Float)).label('pagado'))
+        .group_by(Pagos.id_credito)
+        .subquery()
+    )
+    base = (
+        db.select(
+            Creditos.id_credito, Creditos.id_cliente, Creditos.fecha_inicio,
+            db.cast(Creditos.no_pagos, db.Integer).label('n'),
+            db.cast(Creditos.total_original, db.Float).label('original'),
+            db.func.coalesce(pagado.c.pagado, 0.0).label('pagado'),
+            _dias_hasta(Creditos.fecha_inicio, hasta).label('dias')
+        )
+        .outerjoin(pagado, pagado.c.id_credito == Creditos.id_credito)
+        .where(db.cast(Creditos.total, db.Float) > 0)
+        .subquery()
+    )
+
+    # Cuotas exigibles hasta `hasta` y antes de `desde`; cuotas cubiertas por lo pagado
+    cuota = base.c.original / base.c.n
+    cuotas = (
+        db.select(
+            base,
+            cuota.label('cuota'),
+            _menor(base.c.dias // 7, base.c.n).label('k_hasta'),
+            _menor(_mayor((base.c.dias - (hasta - desde).days - 1) // 7, 0), base.c.n).label('k_antes'),
+            db.func.floor(base.c.pagado / cuota + 0.000001).label('cuotas_pagadas')
+        )
+        .where(base.c.n > 0, base.c.original > 0)
+        .subquery()
+    )
+    dias_hoy = cuotas.c.dias - (hasta - hoy).days
+
+    consulta = (
+        db.select(
+            cuotas.c.id_credito, cuotas.c.id_cliente, cuotas.c.fecha_inicio, cuotas.c.n, cuotas.c.cuota,
+            Cliente.nombre, Cliente.ap_paterno, Cliente.ap_materno, Cliente.telefono,
+            (cuotas.c.k_hasta * cuotas.c.cuota - cuotas.c.pagado).label('importe_total'),
+            _mayor(cuotas.c.k_hasta * cuotas.c.cuota - _mayor(cuotas.c.pagado, cuotas.c.k_antes * cuotas.c.cuota), 0).label('importe_ventana'),
+            _mayor(dias_hoy - 7 * (cuotas.c.cuotas_pagadas + 1), 0).label('dias_atraso')
+        )
+        .join(Cliente, Cliente.id_cliente == cuotas.c.id_cliente)
+        .where(cuotas.c.cuotas_pagadas < cuotas.c.k_hasta)
+        .order_by(Cliente.ap_paterno, Cliente.ap_materno, Cliente.nombre, cuotas.c.id_cliente, cuotas.c.id_credito)
+    )
+    filas = db.session.execute(consulta).all()
+
+    # Agrupar por cliente (las filas vienen ordenadas por cliente)
+    clientes = []
+    for id_cliente, grupo in groupby(filas, key=lambda f: f.id_cliente):
+        grupo = list(grupo)
+        primero = grupo[0]
+        clientes.append({
+            'id_cliente': id_cliente,
+            'nombre': f"{primero.nombre} {primero.ap_paterno} {primero.ap_materno}",
+            'telefono': primero.telefono,
+            'importe_total': round(sum(f.importe_total for f in grupo), 2),
+            'importe_ventana': round(sum(f.importe_ventana for f in grupo), 2),
+            'dias_atraso': max(int(f.dias_atraso) for f in grupo),
+            'creditos': [{
+                'id_credito': f.id_credito,
+                'fecha_inicio': f.fecha_inicio,
+                'no_pagos': f.n,
+                'cuota': round(f.cuota, 2),
+                'importe_total': round(f.importe_total, 2),
+                'importe_ventana': round(f.importe_ventana, 2),
+                'dias_atraso': int(f.dias_atraso)
+            } for f in grupo]
+        })
+    return clientes
+
+def creditos_sin_fecha_valida():
+    # Créditos activos que la lista de cobranza no puede calendarizar porque
+    # su fecha_inicio no está en formato AAAA-MM-DD (p. ej. DD/MM/AAAA)
+    consulta = (
+        db.select(Creditos.id_credito, Creditos.id_cliente, Creditos.fecha_inicio,
+                  Cliente.nombre, Cliente.ap_paterno, Cliente.ap_materno)
+        .join(Cliente, Cliente.id_cliente == Creditos.id_cliente)
+        .where(db.cast(Creditos.total, db.Float) > 0)
+        .where(db.or_(Creditos.fecha_inicio.is_(None), ~Creditos.fecha_inicio.like('____-__-__')))
+        .order_by(Creditos.id_credito)
+    )
+    return [{
+        'id_credito': f.id_credito,
+        'id_cliente': f.id_cliente,
+        'nombre': f"{f.nombre} {f.ap_paterno} {f.ap_materno}",
+        'fecha_inicio': f.fecha_inicio
+    } for f in db.session.execute(consulta)]
+
+def _ventana_cobranza():
+    hoy = date.today()
+    periodo = request.args.get('periodo', 'hoy')
+    desde = hasta = hoy
+    if periodo == 'semana':
+        hasta = hoy + timedelta(days=6)
+    try:
+        if request.args.get('desde'):
+            desde = datetime.strptime(request.args['desde'], '%Y-%m-%d').date()
+        if request.args.get('hasta'):
+            hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d').date()
+    except ValueError:
+        pass
+    if hasta < desde:
+        desde, hasta = hasta, desde
+    return periodo, desde, hasta
+
+@app.route('/cobranza')
+@login_required
+def cobranza():
+    periodo, desde, hasta = _ventana_cobranza()
+    clientes = lista_cobranza(desde, hasta)
+    return render_template(
+        'cobranza.html',
+        clientes=clientes,
+        periodo=periodo,
+        desde=desde,
+        hasta=hasta,
+        total_cobrar=sum(c['importe_total'] for c in clientes),
+        total_ventana=sum(c['importe_ventana'] for c in clientes),
+        excluidos=creditos_sin_fecha_valida()
+    )
+
+@app.route('/cobranza/json')
+@login_required
+def cobranza_json():
+    _, desde, hasta = _ventana_cobranza()
+    return jsonify({
+        'desde': desde.strftime('%Y-%m-%d'),
+        'hasta': hasta.strftime('%Y-%m-%d'),
+        'clientes': lista_cobranza(desde, hasta),
+        'excluidos': creditos_sin_fecha_valida()
+    })
+
+# Puntaje de riesgo por cliente a partir de su historial de pagos
+#
+# pagos.fecha guarda la fecha programada de la cuota; el momento real del pago
+# se toma del alta registrada en la auditoría. Las reversiones son bajas de
+# pagos hechas por cancelar_pago (no las de un crédito eliminado completo).
+
+def _por_cliente(consulta, ids_clientes, columna):
+    if ids_clientes is not None:
+        consulta = consulta.where(columna.in_(ids_clientes))
+    return consulta
+
+def calcular_puntajes(ids_clientes=None):
+    # Créditos previos (activos y archivados)
+    num_creditos = {}
+    for modelo in (Creditos, CreditosArchivo):
+        consulta = _por_cliente(
+            db.select(modelo.id_cliente, db.func.count()).group_by(modelo.id_cliente), ids_clientes, modelo.id_cliente
+        )
+        for id_cliente, cantidad in db.session.execute(consulta):
+            num_creditos[id_cliente] = num_creditos.get(id_cliente, 0) + cantidad
+
+    # Pagos registrados y momento real de cada pago (cuando hay auditoría)
+    num_pagos = {}
+    ids, vencimientos, registros = [], [], []
+    for modelo in (Pagos, PagosArchivo):
+        consulta = _por_cliente(
+            db.select(modelo.id_cliente, db.func.count()).group_by(modelo.id_cliente), ids_clientes, modelo.id_cliente
+        )
+        for id_cliente, cantidad in db.session.execute(consulta):
+            num_pagos[id_cliente] = num_pagos.get(id_cliente, 0) + cantidad
+
+        consulta = _por_cliente(
+            db.select(modelo.id_cliente, modelo.fecha, Auditoria.fecha)
+            .join(Auditoria, Auditoria.id_registro == db.cast(modelo.id_pago, db.String))
+            .where(Auditoria.tabla == 'pagos', Auditoria.accion == 'alta', modelo.fecha.like('____-__-__')),
+            ids_clientes, modelo.id_cliente
+        )
+        for id_cliente, vencimiento, registro in db.session.execute(consulta):
+            ids.append(id_cliente)
+            vencimientos.append(vencimiento)
+            # La auditoría guarda la hora en UTC y los vencimientos son fechas
+            # locales: comparar contra la fecha local en que se registró
+            registros.append(registro.replace(tzinfo=timezone.utc).astimezone().date())
+
+    # Reversiones: bajas de pagos cuyo crédito no fue eliminado
+    creditos_eliminados = db.select(Auditoria.id_credito).where(
+        Auditoria.tabla == 'creditos', Auditoria.accion == 'baja', Auditoria.id_credito.isnot(None)
+    )
+    consulta = _por_cliente(
+        db.select(Auditoria.id_cliente, db.func.count())
+        .where(Auditoria.tabla == 'pagos', Auditoria.accion == 'baja', ~Auditoria.id_credito.in_(creditos_eliminados))
+        .group_by(Auditoria.id_cliente),
+        ids_clientes, Auditoria.id_cliente
+    )
+    reversiones = dict(db.session.execute(consulta).all())
+
+    # Puntualidad con NumPy: días entre la fecha programada y el registro del pago
+    puntualidad = {}
+    if ids:
+        ids = np.array(ids)
+        atraso = np.maximum(
+            (np.array(registros, dtype='datetime64[D]') - np.array(vencimientos, dtype='datetime64[D]')).astype(np.int64), 0
+        )
+        clientes, indice = np.unique(ids, return_inverse=True)
+        conteo = np.bincount(indice)
+        a_tiempo = np.bincount(indice, weights=(atraso == 0))
+        suma_atraso = np.bincount(indice, weights=atraso)
+        for i, id_cliente in enumerate(clientes.tolist()):
+            puntualidad[id_cliente] = (a_tiempo[i] / conteo[i], suma_atraso[i] / conteo[i])
+
+    if ids_clientes is None:
+        ids_clientes = [fila[0] for fila in db.session.execute(db.select(Cliente.id_cliente))]
+
+    puntajes = []
+    for id_cliente in ids_clientes:
+        razon, dias = puntualidad.get(id_cliente, (None, None))
+        creditos_previos = num_creditos.get(id_cliente, 0)
+        cancelados = reversiones.get(id_cliente, 0)
+
+        # Sin historial de puntualidad se usa un valor neutro
+        puntaje = 50 * (razon if razon is not None else 0.5)
+        puntaje += 30 * (1 - min(dias, 28) / 28 if dias is not None else 0.5)
+        puntaje += 20 * min(creditos_previos, 5) / 5
+        puntaje -= min(5 * cancelados, 20)
+
+        puntajes.append({
+            'id_cliente': id_cliente,
+            'puntaje': round(max(0.0, min(100.0, puntaje)), 1),
+            'razon_puntual': round(float(razon), 4) if razon is not None else None,
+            'dias_atraso_prom': round(float(dias), 2) if dias is not None else None,
+            'num_creditos': creditos_previos,
+            'num_pagos': num_pagos.get(id_cliente, 0),
+            'reversiones': cancelados
+        })
+    return puntajes
+
+def _clientes_con_actividad(desde_id):
+    # Clientes con pagos (o créditos nuevos) registrados en la auditoría después de `desde_id`
+    consulta = db.select(Auditoria.id_cliente).distinct().where(
+        Auditoria.id_auditoria > desde_id,
+        Auditoria.id_cliente.isnot(None),
+        db.or_(Auditoria.tabla == 'pagos', db.and_(Auditoria.tabla == 'creditos', Auditoria.accion == 'alta'))
+    )
+    return set(db.session.execute(consulta).scalars())
+
+def actualizar_puntajes(completo=False):
+    ultimo_id = db.session.query(db.func.coalesce(db.func.max(Auditoria.id_auditoria), 0)).scalar()
+
+    if completo:
+        ids_clientes = None
+    else:
+        marca = db.session.query(db.func.coalesce(db.func.max(PuntajeCliente.ultimo_id_auditoria), 0)).scalar()
+        ids_clientes = _clientes_con_actividad(marca)
+        # Clientes que aún no tienen puntaje
+        ids_clientes.update(fila[0] for fila in db.session.execute(
+            db.select(Cliente.id_cliente).where(~Cliente.id_cliente.in_(db.select(PuntajeCliente.id_cliente)))
+        ))
+        if not ids_clientes:
+            return 0
+        # Con muchos clientes pendientes es más barato recalcular todo
+        completo = len(ids_clientes) > 5000
+        ids_clientes = None if completo else sorted(ids_clientes)
+
+    puntajes = calcular_puntajes(ids_clientes)
+    ahora = datetime.utcnow()
+    for puntaje in puntajes:
+        puntaje.update(ultimo_id_auditoria=ultimo_id, fecha_calculo=ahora)
+
+    try:
+        tabla = PuntajeCliente.__table__
+        if completo:
+            db.session.execute(tabla.delete())
+        else:
+            db.session.execute(tabla.delete().where(tabla.c.id_cliente.in_(ids_clientes)))
+        if puntajes:
+            db.session.execute(tabla.insert(), puntajes)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(puntajes)
+
+@app.cli.command('puntajes-riesgo')
+@click.option('--completo', is_flag=True, help='Recalcular a todos los clientes.')
+def puntajes_riesgo_command(completo):
+    """Actualiza el puntaje de riesgo de los clientes con pagos nuevos."""
+    actualizados = actualizar_puntajes(completo)
+    click.echo(f"Puntajes actualizados: {actualizados}")
+
+def obtener_puntajes():
+    return {p.id_cliente: p for p in PuntajeCliente.query.all()}
+
 # Ruta para registrar un nuevo usuario
 @app.route('/register', methods=['GET', 'POST'])
 @login_required
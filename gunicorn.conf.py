@@ -0,0 +1,64 @@
+# Configuracion de gunicorn para produccion
+#
+# Uso: gunicorn app:app
+# (gunicorn carga este archivo automaticamente desde el directorio actual)
+#
+# Variables de entorno soportadas:
+#   PORT                     Puerto de escucha (por defecto 5001)
+#   WEB_CONCURRENCY          Numero de workers (por defecto 2 * CPUs + 1)
+#   GUNICORN_WORKER_CLASS    'sync' o 'gthread' (por defecto 'gthread')
+#   GUNICORN_THREADS         Hilos por worker con gthread (por defecto 4)
+#   GUNICORN_MAX_REQUESTS    Peticiones antes de reciclar un worker (por defecto 1000)
+#   GUNICORN_MAX_REQUESTS_JITTER  Variacion aleatoria del reciclaje (por defecto 100)
+#   GUNICORN_TIMEOUT         Segundos antes de matar un worker bloqueado (por defecto 60)
+
+import os
+import multiprocessing
+
+# Direccion de escucha
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# Cargar la aplicacion en el proceso maestro antes de hacer fork: ReportLab,
+# los modelos y las plantillas se comparten entre workers (copy-on-write)
+preload_app = True
+
+# Workers y tipo de worker
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class not in ('sync', 'gthread'):
+    worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4')) if worker_class == 'gthread' else 1
+
+# Reciclar workers periodicamente para acotar el crecimiento de memoria
+# provocado por los reportes PDF grandes; el jitter evita que todos los
+# workers se reinicien al mismo tiempo
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# Tiempos de espera
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+
+# Logs a la salida estandar
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # El maestro abrio conexiones al importar la app (db.create_all()).
+    # Descartar el pool heredado para que cada worker abra sus propias
+    # conexiones; close=False evita cerrar los sockets del proceso padre.
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    server.log.info("Worker %s: pool de conexiones reiniciado", worker.pid)
+
+
+def worker_exit(server, worker):
+    # Escribir la auditoría pendiente en la cola antes de que termine el worker
+    from app import detener_auditoria
+
+    detener_auditoria()
@@ -0,0 +1,87 @@
+# Prueba de carga para comparar clases de worker de gunicorn
+#
+# Uso:
+#   GUNICORN_WORKER_CLASS=sync gunicorn app:app      (en otra terminal)
+#   python loadtest.py --usuario admin --contrasena secreto
+#
+#   GUNICORN_WORKER_CLASS=gthread gunicorn app:app
+#   python loadtest.py --usuario admin --contrasena secreto
+#
+# Reporta peticiones por segundo y latencias por ruta principal.
+
+import argparse
+import http.cookiejar
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+RUTAS = ['/menu', '/clientes', '/creditos', '/total', '/creditos/pdf']
+
+
+def crear_sesion(base_url, usuario, contrasena):
+    # Iniciar sesión y devolver un opener con la cookie de sesión
+    cookies = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+    datos = urllib.parse.urlencode({'usuario': usuario, 'contrasena': contrasena}).encode()
+    opener.open(f"{base_url}/login", data=datos).read()
+    if not any(c.name == 'session' for c in cookies):
+        raise SystemExit("No se pudo iniciar sesión: verifique usuario y contraseña")
+    return opener
+
+
+def ejecutar_ruta(base_url, ruta, usuario, contrasena, concurrencia, duracion):
+    latencias = []
+    errores = [0]
+    lock = threading.Lock()
+    fin = time.monotonic() + duracion
+
+    def trabajador():
+        opener = crear_sesion(base_url, usuario, contrasena)
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                opener.open(f"{base_url}{ruta}", timeout=30).read()
+                transcurrido = time.perf_counter() - inicio
+                with lock:
+                    latencias.append(transcurrido)
+            except Exception:
+                with lock:
+                    errores[0] += 1
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    latencias.sort()
+    total = len(latencias)
+    return {
+        'ruta': ruta,
+        'peticiones': total,
+        'errores': errores[0],
+        'rps': total / duracion,
+        'p50': latencias[total // 2] * 1000 if total else 0.0,
+        'p95': latencias[int(total * 0.95) - 1] * 1000 if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de las rutas principales')
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--usuario', required=True)
+    parser.add_argument('--contrasena', required=True)
+    parser.add_argument('--concurrencia', type=int, default=16)
+    parser.add_argument('--duracion', type=float, default=20.0, help='Segundos por ruta')
+    parser.add_argument('--rutas', nargs='*', default=RUTAS)
+    args = parser.parse_args()
+
+    print(f"{'Ruta':<16}{'Peticiones':>12}{'Errores':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for ruta in args.rutas:
+        r = ejecutar_ruta(args.url, ruta, args.usuario, args.contrasena, args.concurrencia, args.duracion)
+        print(f"{r['ruta']:<16}{r['peticiones']:>12}{r['errores']:>10}{r['rps']:>10.1f}{r['p50']:>10.1f}{r['p95']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()